@@ -9,84 +9,216 @@
 # --- Core and Third-Party Libraries ---
 import pandas as pd
 import streamlit as st
-from datetime import datetime
-import isodate
 import re
+import hashlib
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from bs4 import BeautifulSoup
-import matplotlib.pyplot as plt
-import matplotlib.patheffects as pe
+from googleapiclient.http import build_http
+from googleapiclient.model import JsonModel
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import time
+import sqlite3
+from pathlib import Path
+import altair as alt
 import numpy as np
+try:
+    import orjson # Optional: decodes API responses much faster than the stdlib json module
+except ImportError:
+    orjson = None
 
 # --- Application Configuration ---
 st.set_page_config(page_title="YouTube Music Wrapped", page_icon="🎧", layout="wide")
 MINIMUM_SONG_DURATION_SECONDS = 60
 MAXIMUM_SONG_DURATION_MINUTES = 7
+TIME_OF_DAY_BUCKET_LABELS = ['Night (0-6)', 'Morning (6-12)', 'Afternoon (12-18)', 'Evening (18-24)']
+TIME_OF_DAY_BUCKET_END_HOURS = np.array([5, 11, 17, 23]) # Inclusive last hour of each bucket above
+METADATA_FETCH_WORKERS = 16
+METADATA_FETCH_TIMEOUT_SECONDS = 30
+METADATA_CACHE_PATH = Path.home() / ".ytmw_cache" / "metadata.sqlite"
+UNAVAILABLE_RETRY_SECONDS = 7 * 24 * 3600 # Videos found unavailable (private, deleted) are asked for again after a week
+_MUSIC_WATCH_URL, _YOUTUBE_WATCH_URL = b"https://music.youtube.com/watch?v=", b"https://www.youtube.com/watch?v="
+_ENTRY_PATTERN = re.compile(rb'<div class="header-cell[^"]*">(.*?)</div>\s*<div class="content-cell[^"]*">(.*?)</div>', re.DOTALL)
+_FIRST_LINK_HREF = re.compile(rb'<a href="([^"]*)"')
+_TIMESTAMP_PATTERN = re.compile(rb'\d{1,2}\s\w{3,4}\s\d{4},\s\d{2}:\d{2}:\d{2}')
+_DURATION_PATTERN = re.compile(r'P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?')
+_worker_state = threading.local() # httplib2 connections are not thread-safe, so each fetch worker keeps its own
 
 # ==============================================================================
 #  1. DATA LOADING AND API INTERACTION
 # ==============================================================================
 
+def hash_file_bytes(file_bytes):
+    """Returns a short content digest used as the cache key for uploaded file bytes."""
+    return hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+
+def parse_html_history(html_bytes):
+    """Parses the bytes of a watch-history.html, reusing the cached result whenever the contents are unchanged."""
+    return _parse_html_history_cached(hash_file_bytes(html_bytes), html_bytes)
+
 @st.cache_data
-def parse_html_history(uploaded_file):
+def _parse_html_history_cached(file_hash, _html_bytes):
     """
     Parses a watch-history.html file by identifying music entries through
     either the URL domain ('music.youtube.com') or an explicit 'YouTube Music'
     text label. Also handles non-standard date abbreviations (e.g., 'Sept').
+    Each record's header and first content cell are matched with one regex
+    pass over the raw bytes, so no DOM is built. Returns the per-listen history
+    and the set of distinct video IDs seen while parsing. Cached on `file_hash`
+    only; the leading underscore keeps Streamlit from re-hashing the full file
+    bytes on every call.
     """
     try:
-        html_content = uploaded_file.read(); soup = BeautifulSoup(html_content, "lxml")
-        records = []; entries = soup.find_all("div", {"class": "content-cell"})
-        timestamp_pattern = re.compile(r'\d{1,2}\s\w{3,4}\s\d{4},\s\d{2}:\d{2}:\d{2}')
-        for entry in entries:
-            link = entry.find("a", href=True)
-            if not link or "watch?v=" not in link["href"]: continue
-            href = link.get("href", ""); header_div = entry.find_previous_sibling("div")
-            header_text = header_div.get_text() if header_div else ""
-            if not ("music.youtube.com" in href or "YouTube Music" in header_text): continue
-            video_id = href.split("watch?v=")[-1].split("&")[0]
-            entry_text = entry.get_text(); match = timestamp_pattern.search(entry_text)
+        ids = []; timestamp_strs = []; video_ids = set()
+        for entry in _ENTRY_PATTERN.finditer(_html_bytes):
+            header, content = entry.groups(); link = _FIRST_LINK_HREF.search(content)
+            if not link: continue
+            href = link.group(1)
+            if href.startswith(_MUSIC_WATCH_URL): video_id = href[len(_MUSIC_WATCH_URL):]
+            elif href.startswith(_YOUTUBE_WATCH_URL) and b"YouTube Music" in header: video_id = href[len(_YOUTUBE_WATCH_URL):]
+            else: continue
+            match = _TIMESTAMP_PATTERN.search(content)
             if match:
-                timestamp_str_fixed = match.group(0).replace("Sept", "Sep")
-                try:
-                    timestamp = datetime.strptime(timestamp_str_fixed, '%d %b %Y, %H:%M:%S')
-                    records.append({"videoId": video_id, "timestamp": timestamp})
-                except ValueError: continue
-        if not records:
-            st.error("Could not parse any valid music entries from the HTML file."); return None
-        return pd.DataFrame(records)
+                video_id = video_id.split(b"&")[0].decode(); ids.append(video_id); video_ids.add(video_id)
+                timestamp_strs.append(match.group(0).replace(b"Sept", b"Sep").decode())
+        history_df = pd.DataFrame({"videoId": ids, "timestamp_str": timestamp_strs})
+        history_df["timestamp"] = pd.to_datetime(history_df["timestamp_str"], format='%d %b %Y, %H:%M:%S', errors='coerce', cache=True)
+        history_df = history_df.dropna(subset=["timestamp"]).drop(columns=["timestamp_str"])
+        if history_df.empty:
+            st.error("Could not parse any valid music entries from the HTML file."); return None, set()
+        return history_df, video_ids
     except Exception as e:
-        st.error(f"An unexpected error occurred during HTML parsing. Error: {e}"); return None
+        st.error(f"An unexpected error occurred during HTML parsing. Error: {e}"); return None, set()
+
+class OrjsonModel(JsonModel):
+    """JsonModel that decodes API responses with orjson, falling back to the stock decoder for non-JSON bodies."""
+    def deserialize(self, content):
+        try: body = orjson.loads(content)
+        except orjson.JSONDecodeError: return super().deserialize(content)
+        return body["data"] if self._data_wrapper and isinstance(body, dict) and "data" in body else body
 
 def build_youtube_client(api_key):
     """Builds and validates the YouTube API service object."""
     try:
-        youtube = build("youtube", "v3", developerKey=api_key, cache_discovery=False)
+        youtube = build("youtube", "v3", developerKey=api_key, cache_discovery=False, model=OrjsonModel() if orjson else None)
         if not hasattr(youtube, 'videos'): raise ValueError("YouTube service object built incorrectly.")
         return youtube
     except Exception as e:
         st.error(f"Failed to build YouTube client: {e}"); return None
 
+@st.cache_resource
+def get_metadata_cache():
+    """
+    Opens the on-disk SQLite cache of previously fetched video metadata, creating
+    it if needed. The connection is shared by every session thread, so it is
+    returned together with the lock that serialises all use of it.
+    """
+    METADATA_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(METADATA_CACHE_PATH, check_same_thread=False)
+    connection.execute("CREATE TABLE IF NOT EXISTS meta (video_id TEXT PRIMARY KEY, duration_sec REAL, title TEXT, artist TEXT, fetched_at REAL)")
+    return connection, threading.Lock()
+
+def load_cached_metadata(cache, video_ids_list):
+    """
+    Returns the cached metadata for whichever of the given video IDs have been
+    fetched before. IDs the API returned nothing for (deleted or private
+    videos) map to None until UNAVAILABLE_RETRY_SECONDS have passed, after which
+    they are left out so the caller asks for them again.
+    """
+    connection, lock = cache; metadata = {}; retry_cutoff = time.time() - UNAVAILABLE_RETRY_SECONDS
+    for i in range(0, len(video_ids_list), 500):
+        batch_ids = video_ids_list[i:i+500]; placeholders = ",".join("?" * len(batch_ids))
+        with lock:
+            rows = connection.execute(f"SELECT video_id, duration_sec, title, artist FROM meta WHERE video_id IN ({placeholders}) AND (duration_sec IS NOT NULL OR fetched_at >= ?)", [*batch_ids, retry_cutoff]).fetchall()
+        for video_id, duration_sec, title, artist in rows:
+            metadata[video_id] = {"duration_sec": duration_sec, "title": title, "artist": artist} if duration_sec is not None else None
+    return metadata
+
+def store_cached_metadata(cache, metadata, unavailable_ids=()):
+    """
+    Inserts or refreshes fetched video metadata in the on-disk cache, recording
+    unavailable IDs with empty, timestamped rows. Zero-length durations are not
+    stored: live streams report 'P0D' until they end, so they are fetched again
+    next time.
+    """
+    connection, lock = cache; fetched_at = time.time()
+    rows = [(video_id, m["duration_sec"], m["title"], m["artist"], fetched_at) for video_id, m in metadata.items() if m["duration_sec"] > 0] + [(video_id, None, None, None, fetched_at) for video_id in unavailable_ids]
+    with lock, connection:
+        connection.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?, ?, ?, ?)", rows)
+
+def parse_youtube_duration(duration):
+    """Converts a YouTube ISO-8601 duration (e.g. 'PT3M25S', 'P1DT2H') to seconds."""
+    match = _DURATION_PATTERN.fullmatch(duration)
+    if not match: raise ValueError(f"Unrecognised duration: {duration}")
+    days, hours, minutes, seconds = (int(part or 0) for part in match.groups())
+    return days * 86400 + hours * 3600 + minutes * 60 + seconds
+
+def _fetch_metadata_batch(request):
+    """
+    Executes one videos().list request on the calling worker thread's own HTTP
+    connection, which stays open for the thread's later batches. Returns the
+    parsed metadata together with the set of IDs the API returned at all, or
+    None if the request itself failed or timed out.
+    """
+    if not hasattr(_worker_state, "http"):
+        http = build_http(); http.timeout = METADATA_FETCH_TIMEOUT_SECONDS
+        http.force_exception_to_status_code = True # Network errors surface as HttpError instead of escaping the worker
+        _worker_state.http = http
+    try:
+        response = request.execute(http=_worker_state.http)
+    except HttpError: return None
+    batch_metadata = {}; returned_ids = set()
+    for item in response.get("items", []):
+        returned_ids.add(item.get("id"))
+        try:
+            batch_metadata[item["id"]] = {"duration_sec": parse_youtube_duration(item["contentDetails"]["duration"]), "title": item["snippet"]["title"], "artist": item["snippet"]["channelTitle"]}
+        except (KeyError, ValueError): continue
+    return batch_metadata, returned_ids
+
+class MetadataFetchError(Exception):
+    """Raised when some videos().list batches failed, so partial metadata is never cached as a full result."""
+
 def fetch_video_metadata(_youtube_client, video_ids, progress_bar, status_text):
-    """Fetches video details from the YouTube API and updates a progress bar."""
-    metadata = {}; video_ids_list = list(video_ids); total_videos = len(video_ids_list)
+    """
+    Fetches video details from the YouTube API concurrently and updates a progress bar.
+    IDs already present in the on-disk metadata cache, including ones recently
+    found unavailable, are not re-requested. Items the API returns but that
+    cannot be parsed yet (e.g. upcoming premieres) are not cached at all.
+    Returns one {videoId: value} dict per field ('duration_sec', 'title',
+    'artist') so they can be mapped straight onto the history. Raises
+    MetadataFetchError after the loop if any batch failed or timed out.
+    """
+    video_ids_list = list(video_ids); total_videos = len(video_ids_list)
     progress_start, progress_end = 10, 90
-    for i in range(0, total_videos, 50):
-        batch_ids = ",".join(video_ids_list[i:i+50])
-        try:
-            request = _youtube_client.videos().list(part="contentDetails,snippet", id=batch_ids)
-            response = request.execute()
-        except HttpError: continue
-        for item in response.get("items", []):
-            try:
-                metadata[item["id"]] = {"duration_sec": isodate.parse_duration(item["contentDetails"]["duration"]).total_seconds(), "title": item["snippet"]["title"], "artist": item["snippet"]["channelTitle"]}
-            except (KeyError, isodate.ISO8601Error): continue
-        processed_count = min(i + 50, total_videos)
-        percent_complete = processed_count / total_videos if total_videos > 0 else 0
-        bar_progress = int(progress_start + (percent_complete * (progress_end - progress_start)))
-        status_text.text(f"Step 2/3: Fetching video details... ({processed_count} of {total_videos})")
-        progress_bar.progress(bar_progress)
+    try:
+        cache = get_metadata_cache(); cached = load_cached_metadata(cache, video_ids_list)
+    except (OSError, sqlite3.Error) as e:
+        st.warning(f"Metadata cache is unavailable, so every video will be fetched from the API. Error: {e}"); cache, cached = None, {}
+    metadata = {"duration_sec": {}, "title": {}, "artist": {}}
+    def add_rows(rows):
+        for video_id, row in rows.items():
+            if row is None: continue
+            for field, values in metadata.items(): values[video_id] = row[field]
+    add_rows(cached)
+    missing_ids = [video_id for video_id in video_ids_list if video_id not in cached]
+    batches = [missing_ids[i:i+50] for i in range(0, len(missing_ids), 50)]
+    with ThreadPoolExecutor(max_workers=METADATA_FETCH_WORKERS) as executor:
+        futures = {executor.submit(_fetch_metadata_batch, _youtube_client.videos().list(part="contentDetails,snippet", id=",".join(batch))): batch for batch in batches}
+        processed_count = total_videos - len(missing_ids); failed_batches = 0
+        for future in as_completed(futures):
+            batch_ids = futures[future]; result = future.result(); processed_count += len(batch_ids)
+            if result is None: failed_batches += 1
+            else:
+                batch_metadata, returned_ids = result
+                if cache is not None:
+                    try: store_cached_metadata(cache, batch_metadata, [video_id for video_id in batch_ids if video_id not in returned_ids])
+                    except sqlite3.Error as e: st.warning(f"Could not update the metadata cache; continuing without it. Error: {e}"); cache = None
+                add_rows(batch_metadata)
+            percent_complete = processed_count / total_videos if total_videos > 0 else 0
+            bar_progress = int(progress_start + (percent_complete * (progress_end - progress_start)))
+            status_text.text(f"Step 2/3: Fetching video details... ({processed_count} of {total_videos})")
+            progress_bar.progress(bar_progress)
+    if failed_batches: raise MetadataFetchError(f"{failed_batches} of {len(batches)} requests to the YouTube API failed or timed out.")
     return metadata
 
 # ==============================================================================
@@ -99,58 +231,104 @@ def analyze_data(history_df, metadata):
     Performs the main one-time analysis: merges data, filters, caps duration,
     and adds time period columns.
     """
-    if history_df is None or not metadata: return None, 0
-    meta_df = pd.DataFrame.from_dict(metadata, orient="index"); music_df = history_df.join(meta_df, on="videoId")
-    music_df.dropna(subset=["duration_sec"], inplace=True)
-    pre_filter_count = len(music_df)
-    music_df_filtered = music_df[music_df['duration_sec'] >= MINIMUM_SONG_DURATION_SECONDS].copy()
+    if history_df is None or not metadata["duration_sec"]: return None, 0
+    # Look each field up once per distinct video, then broadcast to every listen by its code.
+    id_codes, unique_ids = pd.factorize(history_df["videoId"])
+    duration_sec = unique_ids.map(metadata["duration_sec"]).to_numpy(dtype="float64")[id_codes]
+    pre_filter_count = int(np.count_nonzero(~np.isnan(duration_sec)))
+    is_song = duration_sec >= MINIMUM_SONG_DURATION_SECONDS; song_codes = id_codes[is_song]
+    music_df_filtered = history_df[is_song].copy()
+    music_df_filtered["videoId"] = pd.Categorical.from_codes(song_codes, categories=unique_ids)
+    for field in ("title", "artist"): # Built straight as categoricals so the strings are never expanded per listen
+        value_codes, values = pd.factorize(unique_ids.map(metadata[field]))
+        music_df_filtered[field] = pd.Categorical.from_codes(value_codes[song_codes], categories=values)
     if music_df_filtered.empty:
         st.warning(f"No music entries longer than {MINIMUM_SONG_DURATION_SECONDS} seconds were found."); return None, pre_filter_count
-    music_df_filtered["duration_min"] = music_df_filtered["duration_sec"] / 60
-    music_df_filtered["capped_duration_min"] = music_df_filtered["duration_min"].clip(upper=MAXIMUM_SONG_DURATION_MINUTES)
+    duration_min = duration_sec[is_song] / 60 # Only minutes are kept on the frame, in float64 so int() of their sums doesn't lose a minute
+    music_df_filtered["duration_min"] = duration_min
+    music_df_filtered["capped_duration_min"] = np.minimum(duration_min, MAXIMUM_SONG_DURATION_MINUTES)
     music_df_filtered["month"] = music_df_filtered["timestamp"].dt.to_period('M')
     music_df_filtered["week"] = music_df_filtered["timestamp"].dt.to_period('W')
+    music_df_filtered["date"] = music_df_filtered["timestamp"].dt.normalize()
+    music_df_filtered["hour"] = music_df_filtered["timestamp"].dt.hour.astype('int8')
     return music_df_filtered, pre_filter_count
 
-def get_summary_for_period(df, period_label, full_df, granularity):
-    """Calculates all display metrics for a given dataframe with context-aware delta comparison."""
-    if df.empty: return None
+def time_of_day_minutes(df, period_codes, num_periods):
+    """Sums capped minutes into a (num_periods x 4) grid of time-of-day buckets in a single bincount pass."""
+    bucket_ids = np.searchsorted(TIME_OF_DAY_BUCKET_END_HOURS, df["hour"].to_numpy())
+    num_buckets = len(TIME_OF_DAY_BUCKET_LABELS)
+    grid = np.bincount(period_codes * num_buckets + bucket_ids, weights=df["capped_duration_min"].to_numpy(), minlength=num_periods * num_buckets)
+    return grid.reshape(num_periods, num_buckets)
+
+def summarize_aggregates(song_agg, artist_minutes, by_day, bucket_minutes, period_label, growth_text):
+    """Builds all display metrics for one period from its per-song, per-artist, per-day and time-of-day totals."""
     summary = {}
-    summary['total_minutes'] = df["capped_duration_min"].sum()
-    if granularity == "Overall":
-        summary['growth_text'] = None
-    else:
-        current_total = df['capped_duration_min'].sum()
-        if granularity == "By Month":
-            current_period = df['month'].iloc[0]; previous_period = current_period - 1
-            previous_df = full_df[full_df['month'] == previous_period]; period_name = previous_period.strftime('%B')
-        else: # By Week
-            current_period = df['week'].iloc[0]; previous_period = current_period - 1
-            previous_df = full_df[full_df['week'] == previous_period]; period_name = f"previous week"
-        previous_total = previous_df['capped_duration_min'].sum()
-        if previous_total > 0:
-            growth = ((current_total - previous_total) / previous_total) * 100
-            summary['growth_text'] = f"{growth:+.1f}% vs {period_name}"
-        else:
-            summary['growth_text'] = "First period of data"
-    song_agg = df.groupby('title').agg(total_minutes=('capped_duration_min', 'sum'), play_count=('title', 'count'))
-    song_agg['listen_score'] = song_agg['play_count'] * song_agg['total_minutes']
-    song_agg = song_agg.sort_values(by='listen_score', ascending=False)
+    total_minutes = bucket_minutes.sum()
+    summary['total_minutes'] = total_minutes
+    summary['growth_text'] = growth_text
+    song_agg = song_agg.assign(listen_score=song_agg['play_count'] * song_agg['total_minutes']).sort_values(by='listen_score', ascending=False)
     fav_song_series = song_agg.head(1)
     summary['fav_song'] = fav_song_series.index[0] if not fav_song_series.empty else "N/A"
     summary['fav_song_duration'] = fav_song_series['total_minutes'].iloc[0] if not fav_song_series.empty else 0
     summary['top_songs'] = song_agg.head(10)
-    fav_artist = df.groupby("artist")["capped_duration_min"].sum().nlargest(1)
-    summary['fav_artist'] = fav_artist.index[0] if not fav_artist.empty else "N/A"
-    summary['fav_artist_duration'] = fav_artist.iloc[0] if not fav_artist.empty else 0
-    summary['top_artists'] = df.groupby("artist")["capped_duration_min"].sum().nlargest(10)
-    summary['by_day'] = df.groupby(df["timestamp"].dt.date)["capped_duration_min"].sum()
-    summary['total_period_minutes'] = df["capped_duration_min"].sum()
+    top_artists = artist_minutes.nlargest(10)
+    summary['fav_artist'] = top_artists.index[0] if not top_artists.empty else "N/A"
+    summary['fav_artist_duration'] = top_artists.iloc[0] if not top_artists.empty else 0
+    summary['top_artists'] = top_artists
+    summary['by_day'] = by_day
+    summary['total_period_minutes'] = total_minutes
     summary['chart_period_label'] = period_label
-    df["hour"] = df["timestamp"].dt.hour
-    summary['time_buckets'] = df.groupby(pd.cut(df['hour'], bins=[-1, 5, 11, 17, 23], labels=['Night (0-6)', 'Morning (6-12)', 'Afternoon (12-18)', 'Evening (18-24)']))['capped_duration_min'].sum().to_dict()
+    summary['time_buckets'] = dict(zip(TIME_OF_DAY_BUCKET_LABELS, bucket_minutes.tolist()))
     return summary
 
+def get_summary_for_period(df, period_label):
+    """Calculates all display metrics for a given dataframe, treated as a single period with no delta comparison."""
+    if df.empty: return None
+    song_minutes = df.groupby('title', sort=False, observed=True)['capped_duration_min']
+    song_agg = pd.DataFrame({'total_minutes': song_minutes.sum(), 'play_count': song_minutes.size()})
+    artist_minutes = df.groupby("artist", sort=False, observed=True)["capped_duration_min"].sum()
+    by_day = df.groupby("date", sort=False, observed=True)["capped_duration_min"].sum()
+    bucket_minutes = time_of_day_minutes(df, np.zeros(len(df), dtype=np.intp), 1)[0]
+    return summarize_aggregates(song_agg, artist_minutes, by_day, bucket_minutes, period_label, None)
+
+def format_period_label(period, granularity):
+    """Formats a month or week Period the way it is shown in the period selector."""
+    return period.strftime('%B %Y') if granularity == "By Month" else period.start_time.strftime('Week of %b %d, %Y')
+
+def build_period_options(full_df):
+    """Maps each selector label to its Period for every month and week spanned by the history, newest first."""
+    min_date, max_date = full_df['timestamp'].min(), full_df['timestamp'].max()
+    return {granularity: {format_period_label(p, granularity): p for p in pd.period_range(start=min_date, end=max_date, freq=freq)[::-1]} for granularity, freq in (("By Month", "M"), ("By Week", "W"))}
+
+def build_period_summaries(full_df):
+    """
+    Precomputes the summary for the overall view and for every month and week
+    that has listening data, so switching periods in the UI is a dict lookup.
+    Each granularity is aggregated in one grouped pass per metric (a small
+    period x song / artist / day cube) and every period's summary is sliced out
+    of those cubes, rather than re-aggregating the rows of each period.
+    """
+    summaries = {"Overall": {"Overall": get_summary_for_period(full_df, "Overall")}}
+    for granularity, column in (("By Month", "month"), ("By Week", "week")):
+        period_codes, periods = pd.factorize(full_df[column])
+        song_minutes = full_df.groupby([column, 'title'], sort=False, observed=True)['capped_duration_min']
+        song_cube = pd.DataFrame({'total_minutes': song_minutes.sum(), 'play_count': song_minutes.size()}).sort_index()
+        artist_cube = full_df.groupby([column, 'artist'], sort=False, observed=True)['capped_duration_min'].sum().sort_index()
+        day_cube = full_df.groupby([column, 'date'], sort=False, observed=True)['capped_duration_min'].sum().sort_index()
+        bucket_grid = time_of_day_minutes(full_df, period_codes, len(periods))
+        period_totals = dict(zip(periods, bucket_grid.sum(axis=1)))
+        summaries[granularity] = {}
+        for period, bucket_minutes in zip(periods, bucket_grid):
+            current_total = period_totals[period]; previous_period = period - 1; previous_total = period_totals.get(previous_period, 0)
+            if previous_total > 0:
+                period_name = previous_period.strftime('%B') if granularity == "By Month" else "previous week"
+                growth = ((current_total - previous_total) / previous_total) * 100
+                growth_text = f"{growth:+.1f}% vs {period_name}"
+            else:
+                growth_text = "First period of data"
+            summaries[granularity][period] = summarize_aggregates(song_cube.xs(period), artist_cube.xs(period), day_cube.xs(period), bucket_minutes, format_period_label(period, granularity), growth_text)
+    return summaries
+
 # ==============================================================================
 #  3. UI RENDERING & MAIN APP FLOW
 # ==============================================================================
@@ -194,22 +372,28 @@ def render_charts(summary):
     with col1:
         st.subheader("📅 Daily Music Listening"); by_day = summary['by_day']
         if by_day.empty: st.write("No daily listening data to display."); return
-        daily_avg = by_day.mean(); plt.style.use("dark_background"); fig, ax = plt.subplots(figsize=(12, 6))
-        ax.bar(by_day.index, by_day.values, color="#FF0000", alpha=0.9)
-        ax.axhline(daily_avg, color="white", linestyle="--", alpha=0.7, label=f"Avg: {daily_avg:.0f} min/day")
+        daily_avg = by_day.mean(); daily_df = by_day.rename("minutes").rename_axis("date").reset_index()
         title_text = f"Total of {int(summary['total_period_minutes']):,} minutes in {summary['chart_period_label']}"
-        ax.set_title(title_text, fontsize=16, weight="bold", color="white")
-        ax.set_ylabel("Minutes Listened (Capped)"); ax.legend(); fig.autofmt_xdate(); plt.tight_layout(); st.pyplot(fig)
+        bars = alt.Chart(daily_df).mark_bar(color="#FF0000", opacity=0.9).encode(x=alt.X("date:T", title=None), y=alt.Y("minutes:Q", title="Minutes Listened (Capped)"), tooltip=[alt.Tooltip("date:T", title="Date"), alt.Tooltip("minutes:Q", title="Minutes", format=".0f")])
+        avg_rule = alt.Chart(pd.DataFrame({"avg": [daily_avg]})).mark_rule(color="#888888", strokeDash=[6, 4], opacity=0.9).encode(y="avg:Q")
+        chart = (bars + avg_rule).properties(title=alt.TitleParams(title_text, subtitle=f"Avg: {daily_avg:.0f} min/day", fontSize=16), width="container", height=420)
+        st.altair_chart(chart)
     with col2:
         st.subheader("🕒 By Time of Day"); time_buckets = summary.get('time_buckets', {}); sorted_buckets = dict(sorted(time_buckets.items(), key=lambda item: -item[1]))
-        fig2, ax2 = plt.subplots(figsize=(8, 8)); neon_colors = ['#00F5D4', '#00B9FF', '#9B5DE5', '#F15BB5']
+        neon_colors = ['#00F5D4', '#00B9FF', '#9B5DE5', '#F15BB5']
         num_bubbles = len(sorted_buckets); radius = 3.8; angles = np.linspace(0, 2 * np.pi, num_bubbles, endpoint=False) + np.pi / num_bubbles
-        for i, (label, minutes) in enumerate(sorted_buckets.items()):
-            color = neon_colors[i % len(neon_colors)]; size = max(minutes * 1.2, 100) + 200
-            angle = angles[i]; x, y = radius * np.cos(angle), radius * np.sin(angle)
-            ax2.scatter(x, y, s=size * 1.6, color=color, alpha=0.4); ax2.scatter(x, y, s=size, color=color, alpha=1, edgecolors="white", linewidth=1.5)
-            ax2.text(x, y, f"{label}\n{int(minutes)} min", ha="center", va="center", fontsize=10, weight="bold", color="white", path_effects=[pe.withStroke(linewidth=3, foreground='black')])
-        ax2.set_xlim(-8, 8); ax2.set_ylim(-8, 8); ax2.set_aspect('equal', adjustable='box'); ax2.axis("off"); st.pyplot(fig2)
+        bubbles_df = pd.DataFrame({"label": list(sorted_buckets.keys()), "minutes": list(sorted_buckets.values())})
+        bubbles_df["x"], bubbles_df["y"] = radius * np.cos(angles), radius * np.sin(angles)
+        bubbles_df["size"] = np.maximum(bubbles_df["minutes"] * 1.2, 100) + 200; bubbles_df["glow_size"] = bubbles_df["size"] * 1.6
+        bubbles_df["text"] = bubbles_df["label"] + "\n" + bubbles_df["minutes"].astype(int).astype(str) + " min"
+        color = alt.Color("label:N", scale=alt.Scale(domain=bubbles_df["label"].tolist(), range=[neon_colors[i % len(neon_colors)] for i in range(num_bubbles)]), legend=None)
+        base = alt.Chart(bubbles_df).encode(x=alt.X("x:Q", scale=alt.Scale(domain=[-8, 8]), axis=None), y=alt.Y("y:Q", scale=alt.Scale(domain=[-8, 8]), axis=None))
+        glow = base.mark_circle(opacity=0.4).encode(size=alt.Size("glow_size:Q", scale=None), color=color)
+        bubble = base.mark_circle(opacity=1, stroke="white", strokeWidth=1.5).encode(size=alt.Size("size:Q", scale=None), color=color, tooltip=[alt.Tooltip("label:N", title="Time of Day"), alt.Tooltip("minutes:Q", title="Minutes", format=".0f")])
+        # Charts follow the Streamlit theme, so the white labels get a black outline layer underneath to stay legible on any bubble.
+        label_outline = base.mark_text(fontSize=10, fontWeight="bold", color="black", stroke="black", strokeWidth=3, strokeJoin="round", lineBreak="\n").encode(text="text:N")
+        labels = base.mark_text(fontSize=10, fontWeight="bold", color="white", lineBreak="\n").encode(text="text:N")
+        st.altair_chart((glow + bubble + label_outline + labels).properties(width="container", height=420).configure_view(strokeWidth=0))
 
 def render_top_lists(summary):
     st.header("🏆 Your Top 10s"); col1, col2 = st.columns(2)
@@ -225,13 +409,15 @@ def render_top_lists(summary):
 def render_full_data_tables(df):
     with st.expander("🔍 Full Data Explorer (Scroll & Sort to Verify)"):
         st.markdown("### All Songs, Ranked by Listen Score")
-        song_summary = df.groupby('title').agg(total_minutes=('capped_duration_min', 'sum'), actual_minutes=('duration_min', 'sum'), play_count=('title', 'count')).sort_values(by='total_minutes', ascending=False)
+        # One pass over the listens per (song, artist) pair; both tables below roll up from this small intermediate.
+        pair_summary = df.groupby(['title', 'artist'], sort=False, observed=True).agg(capped_minutes=('capped_duration_min', 'sum'), actual_minutes=('duration_min', 'sum'), play_count=('capped_duration_min', 'size'))
+        song_summary = pair_summary.groupby(level='title', sort=False, observed=True).sum().rename(columns={'capped_minutes': 'total_minutes'})
         song_summary['listen_score'] = song_summary['play_count'] * song_summary['total_minutes']
         song_summary = song_summary.sort_values(by='listen_score', ascending=False).reset_index()
         song_summary['listen_score'] = song_summary['listen_score'].astype(int); song_summary['total_minutes'] = song_summary['total_minutes'].astype(int); song_summary['actual_minutes'] = song_summary['actual_minutes'].astype(int)
         st.dataframe(song_summary)
         st.markdown("### All Artists, Ranked by Capped Listen Time")
-        artist_summary = df.groupby('artist').agg(capped_minutes=('capped_duration_min', 'sum'), actual_minutes=('duration_min', 'sum'), play_count=('artist', 'count')).sort_values(by='capped_minutes', ascending=False).reset_index()
+        artist_summary = pair_summary.groupby(level='artist', sort=False, observed=True).sum().sort_values(by='capped_minutes', ascending=False).reset_index()
         artist_summary['capped_minutes'] = artist_summary['capped_minutes'].astype(int); artist_summary['actual_minutes'] = artist_summary['actual_minutes'].astype(int)
         st.dataframe(artist_summary)
 
@@ -249,67 +435,60 @@ def main():
     st.markdown("Your personal YouTube listening history, visualized.")
     api_key, uploaded_file, run_diagnostics = render_sidebar()
     if not api_key or not uploaded_file: st.info("Please provide your API key and upload your `watch-history.html` to begin."); st.stop()
+    html_bytes = uploaded_file.getvalue()
     
     @st.cache_data
-    def get_full_dataset(u_file, api_k):
-        h_df = parse_html_history(u_file)
-        if h_df is None: return None, 0
+    def get_full_dataset(file_hash, _html_bytes, api_k):
+        h_df, u_ids = parse_html_history(_html_bytes)
+        if h_df is None: return None, {}, {}
         yt_client = build_youtube_client(api_k)
-        if not yt_client: return None, 0
+        if not yt_client: return None, {}, {}
         dummy_bar, dummy_text = st.progress(0), st.empty()
-        u_ids = h_df["videoId"].unique()
         meta = fetch_video_metadata(yt_client, u_ids, dummy_bar, dummy_text)
         dummy_bar.empty(); dummy_text.empty()
-        if not meta: return None, 0
-        df, pre_filter_count = analyze_data(h_df, meta)
-        return df, pre_filter_count
+        if not meta["duration_sec"]: return None, {}, {}
+        df, _ = analyze_data(h_df, meta)
+        if df is None: return None, {}, {}
+        return df, build_period_summaries(df), build_period_options(df)
 
     if run_diagnostics:
         progress_bar = st.progress(0); status_text = st.empty()
         status_text.text("Diagnostic Step 1/3: Parsing HTML...");
-        history_df = parse_html_history(uploaded_file)
+        history_df, unique_ids = parse_html_history(html_bytes)
         if history_df is None: st.stop()
         progress_bar.progress(10)
         youtube_client = build_youtube_client(api_key);
         if not youtube_client: st.stop()
-        unique_ids = history_df["videoId"].unique()
-        metadata = fetch_video_metadata(youtube_client, unique_ids, progress_bar, status_text)
-        if not metadata: st.stop()
+        try: metadata = fetch_video_metadata(youtube_client, unique_ids, progress_bar, status_text)
+        except MetadataFetchError as e: st.error(f"{e} Rerun the app to retry the failed requests."); st.stop()
+        if not metadata["duration_sec"]: st.stop()
         status_text.text("Diagnostic Step 3/3: Analyzing..."); progress_bar.progress(90)
         full_music_df, pre_filter_count = analyze_data(history_df, metadata)
         monthly_raw_counts = history_df.copy(); monthly_raw_counts['month'] = monthly_raw_counts['timestamp'].dt.to_period('M')
-        monthly_breakdown = monthly_raw_counts.groupby(monthly_raw_counts['month'].dt.strftime('%B %Y'))['videoId'].count().sort_index(ascending=False).reset_index()
+        monthly_breakdown = monthly_raw_counts.groupby(monthly_raw_counts['month'].dt.strftime('%B %Y'), sort=False, observed=True)['videoId'].count().sort_index(ascending=False).reset_index()
         monthly_breakdown.columns = ["Month", "Raw Listen Count"]
         diagnostics = {"raw_parse_count": len(history_df), "api_metadata_count": pre_filter_count, "final_qualified_count": len(full_music_df) if full_music_df is not None else 0, "monthly_raw_counts": monthly_breakdown}
         progress_bar.empty(); status_text.empty()
         render_diagnostics(diagnostics)
     else:
         with st.spinner("Processing your history for the first time... This may take a few minutes."):
-            full_music_df, _ = get_full_dataset(uploaded_file, api_key)
+            try: full_music_df, period_summaries, period_options = get_full_dataset(hash_file_bytes(html_bytes), html_bytes, api_key)
+            except MetadataFetchError as e: st.error(f"{e} Rerun the app to retry the failed requests."); st.stop()
         if full_music_df is None: st.error("Could not generate analytics from your data."); st.stop()
         st.success("Analysis complete!")
         st.info(f"💡 Note: Song listens >{MAXIMUM_SONG_DURATION_MINUTES} min are capped. Favorite song is ranked by a Listen Score (Plays × Minutes).")
         st.markdown("---")
         granularity = st.radio("Select analysis period:", ["Overall", "By Month", "By Week"], horizontal=True)
-        display_df = pd.DataFrame(); period_label = "Overall"
-        min_date, max_date = full_music_df['timestamp'].min(), full_music_df['timestamp'].max()
-
-        if granularity == "Overall":
-            display_df = full_music_df
-        elif granularity == "By Month":
-            all_months = pd.period_range(start=min_date, end=max_date, freq='M'); month_periods = sorted(all_months, reverse=True)
-            month_options = [p.strftime('%B %Y') for p in month_periods]; selected_month_str = st.selectbox("Select Month:", month_options)
-            if selected_month_str:
-                period_label = selected_month_str; selected_month_period = pd.Period(selected_month_str, freq='M')
-                display_df = full_music_df[full_music_df['month'] == selected_month_period]
+        selected_period = "Overall"
+
+        if granularity == "By Month":
+            month_options = period_options[granularity]; selected_month_str = st.selectbox("Select Month:", list(month_options.keys()))
+            if selected_month_str: selected_period = month_options[selected_month_str]
         elif granularity == "By Week":
-            all_weeks = pd.period_range(start=min_date, end=max_date, freq='W'); week_periods = sorted(all_weeks, reverse=True)
-            week_options = {p.start_time.strftime('Week of %b %d, %Y'): p for p in week_periods}; selected_week_str = st.selectbox("Select Week:", list(week_options.keys()))
-            if selected_week_str:
-                period_label = selected_week_str; selected_week_period = week_options[selected_week_str]
-                display_df = full_music_df[full_music_df['week'] == selected_week_period]
+            week_options = period_options[granularity]; selected_week_str = st.selectbox("Select Week:", list(week_options.keys()))
+            if selected_week_str: selected_period = week_options[selected_week_str]
         
-        summary = get_summary_for_period(display_df, period_label, full_music_df, granularity)
+        summary = period_summaries[granularity].get(selected_period)
         if not summary:
             st.warning(f"No listening data found for the selected period."); st.stop()
         render_kpis(summary)